@@ -4,6 +4,8 @@ import torch
 from encodec import EncodecModel
 from encodec.utils import convert_audio
 
+from buffer_pool import HostBufferPool
+
 
 def encode(
     model: EncodecModel, audio: Tuple[torch.Tensor, int], device: str
@@ -71,6 +73,52 @@ class AudioTokenizer:
         self.model.to(device)
         self.device = device
 
+    def _bucketed_length(self, length: int) -> int:
+        """Round a sample count up to a hop-aligned power-of-two bucket.
+
+        Args:
+            length (int): The number of samples in the longest waveform.
+
+        Returns:
+            int: The padded batch length, a multiple of the encoder hop.
+        """
+        hop_length = self.model.sample_rate // self.model.frame_rate
+        bucket = HostBufferPool.bucket_size(length)
+        return bucket + (-bucket % hop_length)
+
+    def compile(self, batch_size: int = 1):
+        """Compile the EnCodec encoder for the static shapes seen after
+        length bucketing.
+
+        The encoder is the hot submodule that is invoked through forward;
+        encode()'s other steps are plain method calls that torch.compile
+        cannot intercept. Compilation is lazy, so a warm-up forward runs
+        here under the same inference-mode/autocast contexts and batch
+        shape as process_audio_batch, surfacing backend failures
+        immediately and falling back to eager execution.
+
+        Args:
+            batch_size (int): The batch size used at inference time.
+        """
+        encoder = self.model.encoder
+        try:
+            self.model.encoder = torch.compile(
+                encoder, mode="reduce-overhead", fullgraph=False, dynamic=False
+            )
+            warmup = torch.zeros(
+                batch_size,
+                self.model.channels,
+                self._bucketed_length(self.model.sample_rate),
+                device=self.device,
+            )
+            with torch.inference_mode(), torch.autocast(
+                device_type="cuda", dtype=torch.bfloat16
+            ):
+                self.model.encoder(warmup)
+        except Exception as e:
+            print(f"Failed to compile the EnCodec encoder: {e}")
+            self.model.encoder = encoder
+
     @torch.no_grad()
     def decode(self, audio_code: List) -> Tuple[torch.Tensor, int]:
         """Decode interleaved audio codes into audio.
@@ -125,3 +173,53 @@ class AudioTokenizer:
         # Interleave the audio codes between low and high frequency bands
         interleaved = torch.stack((audio_code1, audio_code2), dim=1).flatten()
         return interleaved.tolist()
+
+    @torch.no_grad()
+    def process_audio_batch(
+        self, audios: List[torch.Tensor], sample_rate: int
+    ) -> List[List[int]]:
+        """Process a batch of audio waveforms into interleaved audio codes.
+
+        The waveforms are padded to a hop-aligned power-of-two bucket above
+        the longest item and encoded in a single forward pass, so the
+        compiled encoder sees a small set of repeating shapes; the padded
+        frames are trimmed per item afterwards.
+
+        Args:
+            audios (List[torch.Tensor]): The audio waveforms.
+            sample_rate (int): The sample rate shared by the waveforms.
+
+        Returns:
+            List[List[int]]: The interleaved audio codes for each waveform.
+        """
+        # Resample the waveforms and pad them into a single [B, C, T] batch
+        wavs = [
+            convert_audio(wav, sample_rate, self.model.sample_rate, self.model.channels)
+            for wav in audios
+        ]
+        lengths = [wav.shape[-1] for wav in wavs]
+        batch = torch.nn.utils.rnn.pad_sequence(
+            [wav.squeeze(0) for wav in wavs], batch_first=True
+        )
+        batch = batch.unsqueeze(1).to(self.device)
+        target_length = self._bucketed_length(batch.shape[-1])
+        if target_length > batch.shape[-1]:
+            batch = torch.nn.functional.pad(
+                batch, (0, target_length - batch.shape[-1])
+            )
+
+        # Extract discrete codes from the EnCodec model in one forward pass
+        encoded_frames = self.model.encode(batch)
+        # Concatenate the encoded frames
+        codes = torch.cat([encoded[0] for encoded in encoded_frames], dim=-1)
+
+        # Trim the padded frames and interleave the codes per item
+        hop_length = self.model.sample_rate // self.model.frame_rate
+        batch_codes = []
+        for item, length in enumerate(lengths):
+            num_frames = (length + hop_length - 1) // hop_length
+            audio_code1 = codes[item][0][:num_frames]
+            audio_code2 = codes[item][1][:num_frames]
+            interleaved = torch.stack((audio_code1, audio_code2), dim=1).flatten()
+            batch_codes.append(interleaved.tolist())
+        return batch_codes
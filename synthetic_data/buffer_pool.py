@@ -0,0 +1,47 @@
+"""Pooled pinned host buffers for staging audio waveforms off the GPU."""
+
+from collections import defaultdict
+
+import torch
+
+
+class HostBufferPool:
+    def __init__(self):
+        """Initialize an empty pool of pinned host buffers.
+
+        Buffers are bucketed by power-of-two sizes so a returned buffer can
+        be reused for any waveform that rounds up to the same bucket,
+        instead of allocating and pinning a fresh host tensor per sample.
+        """
+        self.buckets = defaultdict(list)
+
+    @staticmethod
+    def bucket_size(length: int) -> int:
+        """Round a length up to its power-of-two bucket size."""
+        size = 1
+        while size < length:
+            size <<= 1
+        return size
+
+    def get(self, length: int) -> torch.Tensor:
+        """Get a pinned float32 buffer able to hold the given length.
+
+        Args:
+            length (int): The minimum number of samples the buffer must hold.
+        Returns:
+            torch.Tensor: A pinned 1D float32 buffer of the bucket size.
+        """
+        bucket = self.buckets[self.bucket_size(length)]
+        if bucket:
+            return bucket.pop()
+        return torch.empty(
+            self.bucket_size(length), dtype=torch.float32, pin_memory=True
+        )
+
+    def put(self, buffer: torch.Tensor):
+        """Return a buffer obtained from get() to the pool.
+
+        Args:
+            buffer (torch.Tensor): The whole buffer as handed out by get().
+        """
+        self.buckets[buffer.numel()].append(buffer)
@@ -1,40 +1,46 @@
 """Orchestrates the pipeline to convert text to audio and tokenize the audio
-using multiple processes and GPU devices."""
+using multiple processes and GPU devices.
 
-import importlib
+Heavy dependencies (torch, pyarrow, datasets, the model wrappers) are
+imported inside the functions that need them: spawned workers re-import
+this module, and keeping the top level light makes that re-import cheap."""
+
+from __future__ import annotations
+
+import argparse
 import os
 import json
-import warnings
+import queue
+import threading
 import time
-from multiprocessing import Process, Value
-
-import fire
-import torch
-import pyarrow as pa
-from datasets import Dataset, load_dataset
-
-from audio_tokenizer import AudioTokenizer
-from tts_processor import TTSProcessor
-from writer import Writer, save_batch
-from utils import (
-    configure_logging,
-    upload_folder_to_s3,
-    load_config,
-    save_failed_indices,
-    create_non_overlapping_chunks,
-)
+import warnings
+from collections import defaultdict
+from multiprocessing import JoinableQueue, Queue, RawArray, connection
+from typing import TYPE_CHECKING
+
+from logger import logger
+
+if TYPE_CHECKING:
+    from datasets import Dataset
+
+    from audio_tokenizer import AudioTokenizer
+    from tts_processor import TTSProcessor
 
 warnings.filterwarnings("ignore")
 
 
-@torch.no_grad()
 def process_and_save_text(
-    subset: Dataset,
+    dataset: Dataset,
     device: str,
+    tts_processor: TTSProcessor,
+    audio_tokenizer: AudioTokenizer,
     process_id: int,
-    processed_count: Value,
+    processed_counts: RawArray,
+    progress_queue: Queue,
+    task_queue: JoinableQueue,
     save_dir: str,
     save_batch_size: int,
+    tts_batch_size: int,
     sample_rate: int,
     max_retries: int,
     speaker,
@@ -43,29 +49,72 @@ def process_and_save_text(
     """Process the text and save the audio tokens to a CSV file.
 
     Args:
-        subset (Dataset): The subset of the dataset to process.
+        dataset (Dataset): The full dataset; the worker selects the index
+            ranges it pulls from the task queue.
         device (str): The device to use for processing.
+        tts_processor (TTSProcessor): The device's shared TTS processor (CUDA
+            weights shared between same-device workers via IPC), or None to
+            load a private replica in this worker.
+        audio_tokenizer (AudioTokenizer): The device's shared audio tokenizer,
+            or None to load a private replica in this worker.
         process_id (int): The ID of the process.
-        processed_count (Value): The shared value to store the number of processed items.
+        processed_counts (RawArray): The per-worker slots for processed item counts.
+            Each worker only writes its own slot, so no lock is needed.
+        progress_queue (Queue): The queue used to notify the parent of progress
+            after each processed chunk.
+        task_queue (JoinableQueue): The shared queue of (start, end) index
+            ranges; a None sentinel tells the worker to stop.
         save_dir (str): The directory to save the CSV file.
         save_batch_size (int): The batch size to save to the CSV file.
+        tts_batch_size (int): The batch size for TTS and tokenizer inference.
         sample_rate (int): The sample rate for the audio.
         max_retries (int): The maximum number of retries for processing an item.
         speaker (str): The speaker to use for the TTS.
         format (str): The format of the audio file.
     """
-    logger.debug("Process %s will process %s examples.", process_id, len(subset))
-    batch_prompt = subset["prompt"]
-    batch_index = subset["index"]
-    tts_processor = TTSProcessor(device=device)
-    audio_tokenizer = AudioTokenizer(device=device)
+    import torch
+    import pyarrow as pa
+
+    from audio_tokenizer import AudioTokenizer
+    from buffer_pool import HostBufferPool
+    from tts_processor import TTSProcessor
+    from writer import BatchBuilder, Writer, save_batch
+    from utils import save_failed_indices, set_worker_affinity
+
+    # Pin the worker to its own slice of cores and size the intra-op thread
+    # pools to match, so workers do not fight over the same cores
+    cores_per_worker = set_worker_affinity(process_id, len(processed_counts))
+    os.environ["OMP_NUM_THREADS"] = str(cores_per_worker)
+    torch.set_num_threads(cores_per_worker)
+
+    # One-time CUDA math-mode setup: TF32 matmuls and fused SDPA kernels
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.backends.cuda.enable_flash_sdp(True)
+    torch.backends.cuda.enable_mem_efficient_sdp(True)
+
+    # Without share_models_per_device each worker loads its own replicas
+    if tts_processor is None:
+        tts_processor = TTSProcessor(device=device)
+    if audio_tokenizer is None:
+        audio_tokenizer = AudioTokenizer(device=device)
+
+    # Specialize the tokenizer's encoder; length bucketing keeps the set of
+    # shapes small enough for the compile cache to hit. The WhisperSpeech
+    # generate path is not wrapped: it never goes through forward, so
+    # torch.compile has nothing to intercept there
+    audio_tokenizer.compile(tts_batch_size)
+
+    # Resolve the speaker embedding once; every generate call reuses the
+    # device-resident tensor instead of re-uploading it
+    speaker = tts_processor.prepare_speaker(speaker)
 
     # Create a CSV writer for this process
     schema = pa.schema(
         [
             pa.field("index", pa.int64()),
-            pa.field("audio", pa.string()),
-            pa.field("tokens", pa.string()),
+            pa.field("audio", pa.list_(pa.float32())),
+            pa.field("tokens", pa.list_(pa.int32())),
         ]
     )
     file_path = os.path.join(save_dir, f"audio_tokens_{process_id}")
@@ -74,56 +123,224 @@ def process_and_save_text(
 
     failed_indices = []
     saved_failed_indice_path = os.path.join(
-        save_dir, f"failed_indices_{process_id}.json"
+        save_dir, f"failed_indices_{process_id}.jsonl"
     )
+    failed_indices_file = open(saved_failed_indice_path, "a", buffering=1 << 16)
     logger.debug(
         "Process %s will save failed indices to %s.",
         process_id,
         saved_failed_indice_path,
     )
 
-    batch = []
-    for text, index in zip(batch_prompt, batch_index):
-        logger.debug("Process %s processing item sample %s.", process_id, index)
-        for attempt in range(max_retries):
-            try:
-                audio = tts_processor.convert_text_to_audio(text, speaker)
-                audio_tokens = audio_tokenizer.process_single_audio(
-                    (audio, sample_rate)
-                )
-                batch.append(
-                    {
-                        "index": index,
-                        "audio": json.dumps(audio.cpu().squeeze(0).numpy().tolist()),
-                        "tokens": json.dumps(audio_tokens),
-                    }
-                )
-
-                if len(batch) >= save_batch_size:
-                    save_batch(batch, writer)
-                    batch = []
-                    save_failed_indices(failed_indices, saved_failed_indice_path)
-                    failed_indices = []
-
-                with processed_count.get_lock():
-                    processed_count.value += 1
-                break
-            except Exception as e:
-                logger.warning(
-                    "Attempt %s failed for index %s: %s", attempt + 1, index, str(e)
+    # Separate CUDA streams let tokenization and D2H copies of one chunk
+    # overlap TTS of the next; a background thread packs Arrow batches off
+    # the critical path
+    tts_stream = torch.cuda.Stream(device=device)
+    tok_stream = torch.cuda.Stream(device=device)
+    copy_stream = torch.cuda.Stream(device=device)
+    token_queue = queue.Queue(maxsize=2)
+    buffer_pool = HostBufferPool()
+    # A failure in the saver thread lands here so the worker can re-raise it
+    # instead of queueing into a dead consumer forever
+    saver_failure = []
+
+    def pack_and_save():
+        """Drain finished chunks, pack them into batches and save them."""
+        builder = BatchBuilder(schema)
+        in_flight_buffers = []
+        copy_events = []
+
+        def flush():
+            # Wait only on the in-flight copy events, not the whole device,
+            # then write and recycle the buffers
+            while copy_events:
+                copy_events.pop().synchronize()
+            save_batch(builder, writer)
+            while in_flight_buffers:
+                buffer_pool.put(in_flight_buffers.pop())
+
+        try:
+            while True:
+                item = token_queue.get()
+                if item is None:
+                    break
+                chunk_indices, audios, chunk_tokens, event = item
+                # Order the copy stream after the producing stream on the GPU
+                # instead of blocking this thread on the event
+                if event is not None:
+                    copy_stream.wait_event(event)
+                with torch.cuda.stream(copy_stream):
+                    for index, audio, audio_tokens in zip(
+                        chunk_indices, audios, chunk_tokens
+                    ):
+                        # Stage the waveform into a reusable pinned buffer;
+                        # the copy streams back while the next TTS kernels
+                        # launch
+                        waveform = audio.reshape(-1)
+                        audio.record_stream(copy_stream)
+                        host_buffer = buffer_pool.get(waveform.numel())
+                        host_buffer[: waveform.numel()].copy_(
+                            waveform, non_blocking=True
+                        )
+                        in_flight_buffers.append(host_buffer)
+                        # The builder only stores views; the values buffers
+                        # are concatenated in flush(), after the copy events
+                        # resolve
+                        builder.append(
+                            index, host_buffer[: waveform.numel()], audio_tokens
+                        )
+                copy_events.append(copy_stream.record_event())
+                if len(builder) >= save_batch_size:
+                    flush()
+            # Save any remaining items in the batch
+            if len(builder):
+                logger.debug("Saving progress.")
+                flush()
+        except Exception as e:
+            logger.error("Saver thread failed: %s", str(e))
+            saver_failure.append(e)
+            # Keep draining so the producer's bounded put() never blocks on
+            # a dead consumer; the worker re-raises on its next chunk
+            while token_queue.get() is not None:
+                pass
+
+    saver_thread = threading.Thread(target=pack_and_save, daemon=True)
+    saver_thread.start()
+
+    def process_chunk(chunk_prompts, chunk_indices):
+        """Run TTS and tokenization for one chunk, with per-item fallback."""
+        # Fail loudly if the saver thread died instead of producing into a
+        # queue nobody is consuming
+        if saver_failure:
+            raise saver_failure[0]
+        logger.debug(
+            "Process %s processing samples %s-%s.",
+            process_id,
+            chunk_indices[0],
+            chunk_indices[-1],
+        )
+        # Synthesize each unique prompt once and fan the result out to every
+        # index that references it; templated datasets repeat prompts often
+        prompt_groups = defaultdict(list)
+        for text, index in zip(chunk_prompts, chunk_indices):
+            prompt_groups[text].append(index)
+        unique_prompts = list(prompt_groups)
+        try:
+            # Run TTS and tokenization over the whole chunk at once, each on
+            # its own stream so the stages overlap across chunks
+            with torch.cuda.stream(tts_stream), torch.inference_mode(), torch.autocast(
+                device_type="cuda", dtype=torch.bfloat16
+            ):
+                audios = tts_processor.convert_texts_to_audio(unique_prompts, speaker)
+            tok_stream.wait_stream(tts_stream)
+            for audio in audios:
+                audio.record_stream(tok_stream)
+            with torch.cuda.stream(tok_stream), torch.inference_mode(), torch.autocast(
+                device_type="cuda", dtype=torch.bfloat16
+            ):
+                chunk_tokens = audio_tokenizer.process_audio_batch(
+                    audios, sample_rate
                 )
-                if attempt == max_retries - 1:
-                    logger.error("All attempts failed for index %s", index)
-                    failed_indices.append(index)
-
-    # Save any remaining items in the batch
-    if batch:
-        logger.debug("Saving progress.")
-        save_batch(batch, writer)
+            fanout_indices, fanout_audios, fanout_tokens = [], [], []
+            for text, audio, audio_tokens in zip(unique_prompts, audios, chunk_tokens):
+                for index in prompt_groups[text]:
+                    fanout_indices.append(index)
+                    fanout_audios.append(audio)
+                    fanout_tokens.append(audio_tokens)
+            token_queue.put(
+                (fanout_indices, fanout_audios, fanout_tokens, tok_stream.record_event())
+            )
+            processed_counts[process_id] += len(chunk_prompts)
+            progress_queue.put_nowait((process_id, len(chunk_prompts)))
+        except Exception as e:
+            logger.warning(
+                "Batched processing failed for indices %s-%s: %s. "
+                "Retrying items individually.",
+                chunk_indices[0],
+                chunk_indices[-1],
+                str(e),
+            )
+            # Fall back to per-prompt processing with retries for the chunk
+            num_recovered = 0
+            for text, indices in prompt_groups.items():
+                for attempt in range(max_retries):
+                    try:
+                        with torch.inference_mode(), torch.autocast(
+                            device_type="cuda", dtype=torch.bfloat16
+                        ):
+                            audio = tts_processor.convert_text_to_audio(text, speaker)
+                            audio_tokens = audio_tokenizer.process_single_audio(
+                                (audio, sample_rate)
+                            )
+                        token_queue.put(
+                            (
+                                indices,
+                                [audio] * len(indices),
+                                [audio_tokens] * len(indices),
+                                None,
+                            )
+                        )
+                        num_recovered += len(indices)
+                        break
+                    except Exception as e:
+                        logger.warning(
+                            "Attempt %s failed for indices %s: %s",
+                            attempt + 1,
+                            indices,
+                            str(e),
+                        )
+                        if attempt == max_retries - 1:
+                            logger.error("All attempts failed for indices %s", indices)
+                            failed_indices.extend(indices)
+            processed_counts[process_id] += num_recovered
+            progress_queue.put_nowait((process_id, num_recovered))
+
+    # Pull small contiguous index ranges from the shared queue until the
+    # sentinel arrives; fast workers simply take more ranges, so a slow
+    # device never leaves the rest idle at the tail
+    while True:
+        task = task_queue.get()
+        if task is None:
+            task_queue.task_done()
+            break
+        range_start, range_end = task
+        logger.debug(
+            "Process %s took range [%s, %s).", process_id, range_start, range_end
+        )
+        subset = dataset.select(range(range_start, range_end))
+        if subset._indices is not None:
+            # Older datasets versions map even contiguous selects through an
+            # indices table; flatten so subset.data holds the actual rows
+            subset = subset.flatten_indices()
+        # Materialize only this range from the Arrow columns, then order it
+        # by prompt length so each chunk pads to similar lengths and compute
+        # is spent on real samples instead of padding
+        range_prompts = subset.data.column("prompt").to_pylist()
+        range_indices = subset.data.column("index").to_pylist()
+        order = sorted(
+            range(len(range_prompts)), key=lambda pos: len(range_prompts[pos])
+        )
+        for offset in range(0, len(order), tts_batch_size):
+            picked = order[offset : offset + tts_batch_size]
+            process_chunk(
+                [range_prompts[pos] for pos in picked],
+                [range_indices[pos] for pos in picked],
+            )
+            if failed_indices:
+                save_failed_indices(failed_indices, failed_indices_file)
+                failed_indices = []
+        task_queue.task_done()
+
+    # Flush the remaining work and wait for the saver thread
+    token_queue.put(None)
+    saver_thread.join()
+    if saver_failure:
+        raise saver_failure[0]
     if failed_indices:
         logger.info("Saving failed samples.")
-        save_failed_indices(failed_indices, saved_failed_indice_path)
+        save_failed_indices(failed_indices, failed_indices_file)
 
+    failed_indices_file.close()
     writer.close()
 
 
@@ -141,13 +358,22 @@ def run_pipeline(
         save_batch_size (int): The batch size to save to the CSV files.
         sample_rate (int): The sample rate for the audio.
         max_retries (int): The maximum number of retries for processing an item."""
+    import importlib
+
+    import torch.multiprocessing as mp
+
+    from audio_tokenizer import AudioTokenizer
+    from tts_processor import TTSProcessor
+
     print(config)
     # Unpack the configuration
     (
         devices,
         num_procs_per_device,
+        share_models_per_device,
         save_dir,
         save_batch_size,
+        tts_batch_size,
         sample_rate,
         max_retries,
         speaker,
@@ -157,8 +383,10 @@ def run_pipeline(
         for key in [
             "devices",
             "num_procs_per_device",
+            "share_models_per_device",
             "save_dir",
             "save_batch_size",
+            "tts_batch_size",
             "sample_rate",
             "max_retries",
             "speaker",
@@ -174,24 +402,59 @@ def run_pipeline(
     num_workers = len(devices) * num_procs_per_device
     logger.info("Dataset size: %s", len(dataset))
 
-    # Split the dataset into non-overlapping chunks
-    chunks = create_non_overlapping_chunks(dataset, num_workers)
-
-    processed_count = Value("i", 0)  # Value to store the number of items processed
+    # Workers read columns straight from the underlying Arrow table, which
+    # ignores any indices mapping (e.g. from select() on the resume path);
+    # materialize the mapping first so row order and table rows agree
+    if dataset._indices is not None:
+        dataset = dataset.flatten_indices()
+
+    # Optionally share one model replica per device: torch's pickling sends
+    # the CUDA weights as IPC handles instead of copies, so VRAM no longer
+    # scales with num_procs_per_device. Off by default: it requires the
+    # models to pickle cleanly and to hold no mutable device state across
+    # concurrent generate calls, so validate outputs before enabling
+    ctx = mp.get_context("spawn")
+    if share_models_per_device:
+        tts_processors = {device: TTSProcessor(device=device) for device in devices}
+        audio_tokenizers = {
+            device: AudioTokenizer(device=device) for device in devices
+        }
+    else:
+        tts_processors = {device: None for device in devices}
+        audio_tokenizers = {device: None for device in devices}
+
+    # One counter slot per worker; each worker writes only its own slot
+    processed_counts = ctx.RawArray("q", num_workers)
+    # Workers push a (process_id, delta) notification here per chunk
+    progress_queue = ctx.Queue()
+
+    # Fill the shared task queue with small contiguous index ranges; workers
+    # pull dynamically, so skewed ranges and slower devices balance out
+    task_queue = ctx.JoinableQueue()
+    task_size = tts_batch_size * 8
+    for start in range(0, len(dataset), task_size):
+        task_queue.put((start, min(start + task_size, len(dataset))))
+    for _ in range(num_workers):
+        task_queue.put(None)
 
     # Start the worker processes
     worker_processes = []
-    for i, chunk in enumerate(chunks):
+    for i in range(num_workers):
         device = devices[i % len(devices)]
-        p = Process(
+        p = ctx.Process(
             target=process_and_save_text,
             args=(
-                chunk,
+                dataset,
                 device,
+                tts_processors[device],
+                audio_tokenizers[device],
                 i,
-                processed_count,
+                processed_counts,
+                progress_queue,
+                task_queue,
                 save_dir,
                 save_batch_size,
+                tts_batch_size,
                 sample_rate,
                 max_retries,
                 speaker,
@@ -201,10 +464,26 @@ def run_pipeline(
         p.start()
         worker_processes.append(p)
 
-    while any(p.is_alive() for p in worker_processes):
-        # Log the progress every minute
-        logger.info("Processed: %s", processed_count.value)
-        time.sleep(60)
+    # Wait event-driven on progress updates and worker exits instead of
+    # polling on a fixed sleep
+    remaining = list(worker_processes)
+    last_log = 0.0
+    while remaining:
+        ready = connection.wait(
+            [progress_queue._reader] + [p.sentinel for p in remaining], timeout=60
+        )
+        # Drain the queued notifications before logging
+        while True:
+            try:
+                progress_queue.get_nowait()
+            except queue.Empty:
+                break
+        # Wakeups arrive per chunk across all workers; keep the log line to
+        # one per minute while still reacting to worker exits immediately
+        if time.monotonic() - last_log >= 60:
+            logger.info("Processed: %s", sum(processed_counts))
+            last_log = time.monotonic()
+        remaining = [p for p in remaining if p.sentinel not in ready]
 
     # Wait for the worker processes to finish
     for p in worker_processes:
@@ -213,7 +492,7 @@ def run_pipeline(
     logger.info("All worker processes have finished.")
 
     # Log the final counts
-    logger.info("Final processed count: %s", processed_count.value)
+    logger.info("Final processed count: %s", sum(processed_counts))
 
 
 def main(config_path: str = "./synthetic_generation_cfg.yaml"):
@@ -221,6 +500,10 @@ def main(config_path: str = "./synthetic_generation_cfg.yaml"):
 
     Args:
         config_path (str): The path to the configuration file."""
+    from datasets import load_dataset
+
+    from utils import configure_logging, load_config, upload_folder_to_s3
+
     config = load_config(config_path)
     global logger
 
@@ -263,4 +546,13 @@ def main(config_path: str = "./synthetic_generation_cfg.yaml"):
 
 
 if __name__ == "__main__":
-    fire.Fire(main)
+    parser = argparse.ArgumentParser(
+        description="Convert text prompts to audio and audio tokens."
+    )
+    parser.add_argument(
+        "--config-path",
+        default="./synthetic_generation_cfg.yaml",
+        help="The path to the configuration file.",
+    )
+    args = parser.parse_args()
+    main(args.config_path)
@@ -1,3 +1,5 @@
+from typing import List
+
 import torchaudio
 
 from whisperspeech.pipeline import Pipeline
@@ -33,6 +35,7 @@ class TTSProcessor:
         self.pipe = Pipeline(
             s2a_ref="collabora/whisperspeech:s2a-q4-tiny-en+pl.model", device=device
         )
+        self.device = device
 
     def get_reference_voice_embedding(self, path: str):
         """Get the reference voice embedding from the given audio file.
@@ -43,6 +46,23 @@ class TTSProcessor:
             torch.Tensor: The reference voice embedding."""
         return self.pipe.extract_spk_emb(path).cpu()
 
+    def prepare_speaker(self, speaker):
+        """Cache the speaker embedding on the pipeline's device.
+
+        The embeddings in speakers.py are CPU tensors; resolving and moving
+        the embedding once per worker avoids repeating that work on every
+        generate call.
+
+        Args:
+            speaker: The speaker embedding tensor, or a path to a reference
+                audio file to embed.
+        Returns:
+            torch.Tensor: The speaker embedding on the pipeline's device.
+        """
+        if isinstance(speaker, str):
+            speaker = self.pipe.extract_spk_emb(speaker)
+        return speaker.to(self.device)
+
     def convert_text_to_audio(self, text: str, speaker=None):
         """Convert text to audio.
 
@@ -54,6 +74,21 @@ class TTSProcessor:
         """
         return self.pipe.generate(text, speaker=speaker)
 
+    def convert_texts_to_audio(self, texts: List[str], speaker=None) -> List:
+        """Convert a batch of texts to audio.
+
+        The underlying pipeline generates one prompt at a time, so the batch
+        is iterated here with a single warm pipeline; callers batch the
+        downstream tokenization over the returned waveforms.
+
+        Args:
+            texts (List[str]): The texts to convert to audio.
+
+        Returns:
+            List[torch.Tensor]: The generated audio for each text.
+        """
+        return [self.pipe.generate(text, speaker=speaker) for text in texts]
+
     def convert_text_to_audio_file(self, text: str, output_path: str, speaker=None):
         """Convert text to audio and save it to a file.
 
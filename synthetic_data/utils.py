@@ -1,6 +1,5 @@
 import os
 import logging
-from math import ceil
 from multiprocessing import Pool
 from logging.handlers import RotatingFileHandler
 
@@ -8,26 +7,32 @@ import boto3
 import yaml
 
 
-def create_non_overlapping_chunks(dataset, num_workers):
-    """Create non-overlapping chunks of the dataset for processing.
+def set_worker_affinity(process_id: int, num_workers: int) -> int:
+    """Pin the worker process to its own contiguous slice of CPU cores.
+
+    Splitting the cores evenly keeps each worker's allocations and host-to-
+    device copies local to one node instead of migrating across sockets.
 
     Args:
-        dataset (Dataset): The dataset to split into chunks.
-        num_workers (int): The number of workers to split the dataset into.
+        process_id (int): The ID of the worker process.
+        num_workers (int): The total number of worker processes.
     Returns:
-        List[Dataset]: The list of non-overlapping chunks of the dataset."""
-    indices = list(range(len(dataset)))
-    chunk_size = ceil(len(indices) / num_workers)
-    return [
-        dataset.select(indices[i : i + chunk_size])
-        for i in range(0, len(indices), chunk_size)
-    ]
-
-
-def save_failed_indices(batch_of_failed_indices: list, file_path: str):
-    """Save the failed indices to a file."""
-    with open(file_path, "w+") as f:
-        f.write("\n".join(map(str, batch_of_failed_indices)) + "\n")
+        int: The number of cores assigned to the worker."""
+    cores = sorted(os.sched_getaffinity(0))
+    cores_per_worker = max(1, len(cores) // num_workers)
+    start = (process_id * cores_per_worker) % len(cores)
+    assigned = cores[start : start + cores_per_worker] or cores
+    os.sched_setaffinity(0, assigned)
+    return len(assigned)
+
+
+def save_failed_indices(batch_of_failed_indices: list, file_handle):
+    """Append the failed indices to an open .jsonl file, one index per line.
+
+    The handle is opened once per worker in append mode, so each flush only
+    writes the new indices instead of rewriting the whole file."""
+    file_handle.write("\n".join(map(str, batch_of_failed_indices)) + "\n")
+    file_handle.flush()
 
 
 def load_config(config_path: str) -> dict:
@@ -1,5 +1,6 @@
 from typing import Union
 
+import numpy as np
 import pyarrow as pa
 import pyarrow.csv as pa_csv
 import pyarrow.parquet as pa_parquet
@@ -12,7 +13,9 @@ class Writer:
         Args:
             file_path (str): The path to the file.
             schema (pyarrow.Schema): The schema of the file.
-            format (str): The format of the file to write.
+            format (str): The format of the file to write. Use "arrow" (IPC
+                streaming) for intermediate shards and "parquet" for archived
+                output.
         """
         self.file_path = file_path + "." + format
         self.schema = schema
@@ -24,8 +27,18 @@ class Writer:
         """Open the file for writing."""
         if self.format == "csv":
             self.writer = pa_csv.CSVWriter(self.file_path, self.schema)
+        elif self.format == "arrow":
+            self.writer = pa.ipc.new_stream(self.file_path, self.schema)
         elif self.format == "parquet":
-            self.writer = pa_parquet.ParquetWriter(self.file_path, self.schema)
+            self.writer = pa_parquet.ParquetWriter(
+                self.file_path,
+                self.schema,
+                compression="zstd",
+                compression_level=3,
+                use_dictionary=True,
+                write_statistics=False,
+                data_page_size=1 << 20,
+            )
 
     def write(self, batch):
         """Write a batch of data to the file."""
@@ -37,21 +50,74 @@ class Writer:
             self.writer.close()
 
 
-def save_batch(batch, writer):
-    """Save a batch of data to the file.
+class BatchBuilder:
+    def __init__(self, schema):
+        """Initialize the builder with the schema of the output table.
 
-    Args:
-        batch (List[dict]): The batch of data to save.
-        writer (writer): The writer to use for saving the data
-    """
-    # Create pa.array from the data
-    index_array = pa.array([item["index"] for item in batch], type=pa.int64())
-    audio_array = pa.array([item["audio"] for item in batch], type=pa.string())
-    tokens_array = pa.array([item["tokens"] for item in batch], type=pa.string())
+        Rows are appended straight into per-column value and offset buffers,
+        so building the table is a single pass with no intermediate per-row
+        dicts or arrays.
+
+        Args:
+            schema (pyarrow.Schema): The schema of the output table.
+        """
+        self.schema = schema
+        self.reset()
+
+    def __len__(self):
+        return len(self.indices)
+
+    def reset(self):
+        """Clear the accumulated column buffers."""
+        self.indices = []
+        self.audio_values = []
+        self.audio_offsets = [0]
+        self.token_values = []
+        self.token_offsets = [0]
+
+    def append(self, index, audio, tokens):
+        """Append one row to the column buffers.
 
-    # Create batch table
-    batch_table = pa.Table.from_arrays(
-        [index_array, audio_array, tokens_array], schema=writer.schema
-    )
+        Args:
+            index (int): The dataset index of the row.
+            audio: The waveform samples (numpy array or CPU tensor).
+            tokens (List[int]): The interleaved audio codes.
+        """
+        self.indices.append(index)
+        audio = np.asarray(audio, dtype=np.float32)
+        self.audio_values.append(audio)
+        self.audio_offsets.append(self.audio_offsets[-1] + audio.shape[0])
+        tokens = np.asarray(tokens, dtype=np.int32)
+        self.token_values.append(tokens)
+        self.token_offsets.append(self.token_offsets[-1] + tokens.shape[0])
+
+    def build(self):
+        """Assemble the accumulated columns into a table and reset.
+
+        Returns:
+            pyarrow.Table: The batch table ready to be written.
+        """
+        index_array = pa.array(self.indices, type=pa.int64())
+        audio_array = pa.ListArray.from_arrays(
+            pa.array(self.audio_offsets, type=pa.int32()),
+            pa.array(np.concatenate(self.audio_values), type=pa.float32()),
+        )
+        tokens_array = pa.ListArray.from_arrays(
+            pa.array(self.token_offsets, type=pa.int32()),
+            pa.array(np.concatenate(self.token_values), type=pa.int32()),
+        )
+        batch_table = pa.Table.from_arrays(
+            [index_array, audio_array, tokens_array], schema=self.schema
+        )
+        self.reset()
+        return batch_table
 
-    writer.write(batch_table)
+
+def save_batch(builder, writer):
+    """Save the accumulated batch to the file.
+
+    Args:
+        builder (BatchBuilder): The builder holding the batch columns.
+        writer (Writer): The writer to use for saving the data
+    """
+    writer.write(builder.build())